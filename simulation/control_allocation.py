@@ -0,0 +1,219 @@
+import math
+
+import numpy as np
+
+from rotors import rotor_map, w_max
+
+
+def _max_scale(base, direction, lower, upper):
+    """
+    Largest s in [0, 1] per sample such that lower <= base + s * direction <= upper.
+
+    Args:
+        base: N x 4 rotor speeds squared, assumed feasible
+        direction: N x 4 change in rotor speeds squared
+        lower, upper: bounds on rotor speeds squared
+
+    Returns:
+        s: N vector of scale factors
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        limit = np.where(direction > 0, (upper - base) / direction,
+                         np.where(direction < 0, (lower - base) / direction, np.inf))
+    return np.clip(np.min(limit, axis=-1), 0.0, 1.0)
+
+
+class ControlAllocator:
+    """
+    Map desired thrust and torques to rotor speeds, respecting rotor saturation.
+
+    The inverse of the rotor map is computed once. When the desired wrench is not
+    achievable, thrust and roll/pitch torque are allocated first and yaw torque is
+    fitted into the room that is left, so every rotor stays within [0, w_max]:
+
+    1. roll/pitch torque is kept, and only scaled down if its rotor spread alone
+       exceeds [0, w_max^2]
+    2. the collective thrust is moved just enough to fit around it
+    3. yaw torque is scaled down to fit in the remaining room
+
+    Roll/pitch therefore take priority over collective thrust: at full throttle
+    thrust is cut to keep attitude authority, rather than the other way round.
+
+    Args:
+        rotor_map: 4x4 matrix from omega^2 to [thrust, torque_x, torque_y, torque_z]
+        w_max: maximum rotor speed, rad/s
+    """
+
+    def __init__(self, rotor_map=rotor_map, w_max=w_max):
+        self.rotor_map = np.asarray(rotor_map, dtype=float)
+        self.rotor_map_inv = np.linalg.inv(self.rotor_map)
+        self.upper = float(w_max)**2
+
+        # columns of the inverse, used to split the allocation by priority
+        self._thrust = self.rotor_map_inv[:, 0]
+        self._roll_pitch = self.rotor_map_inv[:, 1:3]
+        self._yaw = self.rotor_map_inv[:, 3]
+
+        if np.any(self._thrust <= 0.0):
+            raise ValueError('every rotor must contribute positive thrust')
+
+        # largest omega^2 in units of thrust per rotor
+        self._thrust_upper = self.upper / self._thrust
+
+        # the same as lists, plus rotor pairs (i, j) with i < j, for single saturated samples
+        self._thrust_list = self._thrust.tolist()
+        self._thrust_upper_list = self._thrust_upper.tolist()
+        self._roll_pitch_list = self._roll_pitch.tolist()
+        self._yaw_list = self._yaw.tolist()
+        self._pairs = list(zip(*np.triu_indices(4, 1)))
+
+    def allocate(self, wrench):
+        """
+        Compute rotor speeds for a desired wrench.
+
+        Args:
+            wrench: [thrust, torque_x, torque_y, torque_z], shape (4,) or (N, 4)
+
+        Returns:
+            omega: rotor speeds, same shape as wrench
+            saturated: boolean mask of axes that could not be achieved, same shape as wrench
+        """
+        wrench = np.asarray(wrench, dtype=float)
+        single = wrench.ndim == 1
+
+        if single:
+            # fast path for the control loop: most samples are not saturated
+            u = self.rotor_map_inv @ wrench
+            if u.min() >= 0.0 and u.max() <= self.upper:
+                return np.sqrt(u), np.zeros(4, dtype=bool)
+            return self._allocate_saturated(wrench)
+
+        # thrust and roll/pitch together: per rotor u = T * c + s * rp, with c the thrust
+        # column; express rp in units of thrust so the bounds read T + s * ratio in [0, upper / c]
+        u_roll_pitch = wrench[:, 1:3] @ self._roll_pitch.T
+        ratio = u_roll_pitch / self._thrust
+
+        # every pair of rotors i, j needs s * (ratio_j - ratio_i) <= upper / c_j
+        spread = ratio[:, None, :] - ratio[:, :, None]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            limit = np.where(spread > 0, self._thrust_upper / spread, np.inf)
+        s_roll_pitch = np.clip(np.min(limit, axis=(-2, -1)), 0.0, 1.0)
+        ratio = s_roll_pitch[:, None] * ratio
+
+        # collective thrust moved just enough to fit around the roll/pitch torque
+        thrust_lower = np.max(-ratio, axis=-1)
+        thrust_upper = np.min(self._thrust_upper - ratio, axis=-1)
+        thrust = np.clip(wrench[:, 0], thrust_lower, thrust_upper)
+        u = (thrust[:, None] + ratio) * self._thrust
+
+        # yaw last
+        u_yaw = np.outer(wrench[:, 3], self._yaw)
+        s_yaw = _max_scale(u, u_yaw, 0.0, self.upper)
+        u = u + s_yaw[:, None] * u_yaw
+
+        saturated = np.stack([thrust != wrench[:, 0], s_roll_pitch < 1.0, s_roll_pitch < 1.0, s_yaw < 1.0], axis=-1)
+        saturated &= wrench != 0.0
+
+        # samples whose full wrench is achievable are used as is, even if an
+        # intermediate stage above went out of bounds
+        u_full = wrench @ self.rotor_map_inv.T
+        feasible = np.all((u_full >= 0.0) & (u_full <= self.upper), axis=-1)
+        u[feasible] = u_full[feasible]
+        saturated[feasible] = False
+
+        # guard against round-off before the square root
+        omega = np.sqrt(np.clip(u, 0.0, self.upper))
+
+        return omega, saturated
+
+    def _allocate_saturated(self, wrench):
+        # same allocation as the batch path for one saturated sample; plain floats on
+        # 4-element lists, since numpy call overhead dominates at this size
+        thrust_desired, torque_x, torque_y, torque_z = wrench.tolist()
+        c = self._thrust_list
+        thrust_upper = self._thrust_upper_list
+        ratio = [(rx * torque_x + ry * torque_y) / ci for (rx, ry), ci in zip(self._roll_pitch_list, c)]
+
+        # s * |ratio_j - ratio_i| must fit below upper / c of the rotor that is pushed up
+        s_roll_pitch = 1.0
+        for i, j in self._pairs:
+            spread = ratio[j] - ratio[i]
+            if spread > 0.0:
+                s_roll_pitch = min(s_roll_pitch, thrust_upper[j] / spread)
+            elif spread < 0.0:
+                s_roll_pitch = min(s_roll_pitch, thrust_upper[i] / -spread)
+        ratio = [s_roll_pitch * r for r in ratio]
+
+        # collective thrust moved just enough to fit around the roll/pitch torque
+        thrust = min(max(thrust_desired, max(-r for r in ratio)), min(tu - r for tu, r in zip(thrust_upper, ratio)))
+        u = [(thrust + r) * ci for r, ci in zip(ratio, c)]
+
+        # yaw last
+        u_yaw = [torque_z * y for y in self._yaw_list]
+        s_yaw = 1.0
+        for ui, di in zip(u, u_yaw):
+            if di > 0.0:
+                s_yaw = min(s_yaw, (self.upper - ui) / di)
+            elif di < 0.0:
+                s_yaw = min(s_yaw, -ui / di)
+        s_yaw = max(s_yaw, 0.0)
+
+        # guard against round-off before the square root
+        omega = np.array([math.sqrt(min(max(ui + s_yaw * di, 0.0), self.upper)) for ui, di in zip(u, u_yaw)])
+        saturated = np.array([thrust != thrust_desired and thrust_desired != 0.0,
+                              s_roll_pitch < 1.0 and torque_x != 0.0,
+                              s_roll_pitch < 1.0 and torque_y != 0.0,
+                              s_yaw < 1.0 and torque_z != 0.0])
+
+        return omega, saturated
+
+    def wrench(self, omega):
+        """
+        Thrust and torques produced by rotor speeds, shape (4,) or (N, 4).
+        """
+        return np.asarray(omega)**2 @ self.rotor_map.T
+
+
+def allocate(wrench, rotor_map=rotor_map, w_max=w_max):
+    """
+    One-off allocation; build a ControlAllocator to reuse the factorization in a loop.
+    """
+    return ControlAllocator(rotor_map, w_max).allocate(wrench)
+
+
+if __name__ == '__main__':
+	allocator = ControlAllocator()
+	thrust_max = allocator.wrench(np.full(4, w_max))[0]
+
+	# unsaturated: the wrench is reproduced exactly
+	hover = np.array([0.5 * thrust_max, 0.01, -0.02, 0.005])
+	omega, saturated = allocator.allocate(hover)
+	assert np.allclose(allocator.wrench(omega), hover)
+	assert not saturated.any()
+
+	# yaw only: thrust and roll/pitch are kept, yaw is cut to fit
+	yaw = np.array([0.5 * thrust_max, 0.0, 0.0, 1.0])
+	omega, saturated = allocator.allocate(yaw)
+	achieved = allocator.wrench(omega)
+	assert np.allclose(achieved[:3], yaw[:3], atol=1e-12)
+	assert 0.0 < achieved[3] < yaw[3]
+	assert list(saturated) == [False, False, False, True]
+
+	# over thrust: roll torque is kept, collective thrust is cut
+	over = np.array([1.2 * thrust_max, 0.05, 0.0, 0.01])
+	omega, saturated = allocator.allocate(over)
+	achieved = allocator.wrench(omega)
+	assert np.all(omega <= w_max)
+	assert achieved[0] < thrust_max
+	assert np.allclose(achieved[1:3], over[1:3], atol=1e-12)
+	assert saturated[0] and not saturated[1] and not saturated[2]
+
+	# batch and single samples agree
+	batch = np.vstack([hover, yaw, over])
+	omega_batch, saturated_batch = allocator.allocate(batch)
+	for i, sample in enumerate(batch):
+		omega, saturated = allocator.allocate(sample)
+		assert np.allclose(omega, omega_batch[i])
+		assert np.array_equal(saturated, saturated_batch[i])
+
+	print('control allocation checks passed')
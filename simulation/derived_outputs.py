@@ -0,0 +1,246 @@
+import numpy as np
+
+from rotors import rotor_map
+from utilities import body_to_inertial
+from rigid_body import state_names, input_names, wrench_names
+
+
+def _find_rows(labels, names):
+    """
+    Find the rows of names in labels, allowing for subsystem prefixes.
+
+    A label matches a name if it is equal to it or ends with '_<name>' or '.<name>',
+    as in the state labels of an interconnected system ('quadcopter_nonlinear_pos_x').
+
+    Args:
+        labels: signal labels of a response, e.g. result.state_labels
+        names: signal names to look up
+
+    Returns:
+        rows: list of row indices, one per name
+    """
+    labels = list(labels)
+    rows = []
+    for name in names:
+        if name in labels:
+            rows.append(labels.index(name))
+            continue
+        matches = [i for i, label in enumerate(labels) if label.endswith('_' + name) or label.endswith('.' + name)]
+        if len(matches) != 1:
+            found = 'not found' if not matches else 'ambiguous: ' + ', '.join(labels[i] for i in matches)
+            raise ValueError(f"signal '{name}' {found} in {labels}")
+        rows.append(matches[0])
+    return rows
+
+
+class DerivedOutputs:
+    """
+    Lazily computed output channels of a rigid body simulation.
+
+    Channels are computed in one vectorized pass over the stored state and
+    input arrays the first time they are requested, then cached. Channels that
+    were already integrated as outputs (e.g. thrust) are taken from result.outputs.
+
+    Signals are found by label, allowing for subsystem prefixes. Rotor speeds are
+    looked up in the inputs, then in the outputs, since inside an interconnect
+    they are internal signals and only available if they were integrated.
+
+    Args:
+        result: response from ct.input_output_response
+        params: rigid body parameters (mass and gravity are needed for the load factor)
+        sys: simulated system; its params are used when neither params nor result.params are set,
+            e.g. when params were assigned to sys.params instead of passed to input_output_response
+    """
+
+    def __init__(self, result, params=None, sys=None):
+        self.t = result.t
+        self._result = result
+        if params is None:
+            params = getattr(result, 'params', None) or getattr(sys, 'params', None)
+        self.params = params if params is not None else {}
+        self._cache = {}
+
+        self._channels = {
+            'wrench': self._wrench,
+            'vel_body': self._vel_body,
+            'load_factor': self._load_factor,
+            'rotor_power': self._rotor_power,
+            'power': self._power,
+        }
+        self._groups = {
+            **{name: ('wrench', i) for i, name in enumerate(wrench_names)},
+            **{name: ('vel_body', i) for i, name in enumerate(['vel_body_x', 'vel_body_y', 'vel_body_z'])},
+            **{name: ('rotor_power', i) for i, name in enumerate(['power_r1', 'power_r2', 'power_r3', 'power_r4'])},
+        }
+
+    def names(self):
+        return state_names + input_names + list(self._groups) + list(self._channels)
+
+    def set_params(self, params):
+        """
+        Replace the parameters and drop the channels that depend on them.
+        """
+        self.params = params
+        self._cache.pop('load_factor', None)
+
+    @property
+    def states(self):
+        # 12 x N, rigid body states in the order of state_names
+        if 'states' not in self._cache:
+            rows = _find_rows(self._result.state_labels, state_names)
+            self._cache['states'] = np.atleast_2d(self._result.states)[rows]
+        return self._cache['states']
+
+    @property
+    def inputs(self):
+        # 4 x N, rotor speeds in the order of input_names
+        if 'inputs' not in self._cache:
+            try:
+                rows = _find_rows(self._result.input_labels, input_names)
+                inputs = np.atleast_2d(self._result.inputs)[rows]
+            except ValueError:
+                inputs = self._integrated(input_names)
+                if inputs is None:
+                    raise ValueError(f"rotor speeds {input_names} not found in input labels "
+                                     f"{list(self._result.input_labels)} or output labels {self._output_labels()}")
+            self._cache['inputs'] = inputs
+        return self._cache['inputs']
+
+    def _output_labels(self):
+        return list(getattr(self._result, 'output_labels', None) or [])
+
+    def _integrated(self, names):
+        # rows of result.outputs for names, or None if they were not all integrated
+        try:
+            rows = _find_rows(self._output_labels(), names)
+        except ValueError:
+            return None
+        return np.atleast_2d(self._result.outputs)[rows]
+
+    def __getitem__(self, name):
+        if name in state_names:
+            return self.states[state_names.index(name)]
+        if name in input_names:
+            return self.inputs[input_names.index(name)]
+        if name in wrench_names and 'wrench' not in self._cache:
+            integrated = self._integrated([name])
+            if integrated is not None:
+                return integrated[0]
+        if name in self._groups:
+            group, i = self._groups[name]
+            return self._get(group)[i]
+        if name in self._channels:
+            return self._get(name)
+        raise KeyError(f"unknown output channel '{name}'")
+
+    def _get(self, group):
+        if group not in self._cache:
+            self._cache[group] = self._channels[group]()
+        return self._cache[group]
+
+    def _wrench(self):
+        # thrust, torque_x, torque_y, torque_z for every sample
+        integrated = self._integrated(wrench_names)
+        if integrated is not None:
+            return integrated
+        return rotor_map @ self.inputs**2
+
+    def _vel_body(self):
+        phi, theta, psi = self.states[6], self.states[7], self.states[8]
+        R = body_to_inertial(phi, theta, psi)   # 3 x 3 x N
+        v = self.states[3:6]
+        # inertial to body is R^T
+        return np.einsum('jin,jn->in', R, v)
+
+    def _load_factor(self):
+        missing = [key for key in ('mass', 'gravity') if key not in self.params]
+        if missing:
+            raise ValueError(f"load_factor needs params {missing}, pass params or sys to derived_outputs()")
+        return self._get('wrench')[0] / (self.params['mass'] * self.params['gravity'])
+
+    def _rotor_power(self):
+        # reaction torque times rotor speed, with the yaw row of rotor_map as used by the dynamics
+        w = self.inputs
+        return np.abs(rotor_map[3])[:, None] * w**2 * np.abs(w)
+
+    def _power(self):
+        return np.sum(self._get('rotor_power'), axis=0)
+
+
+def derived_outputs(result, params=None, sys=None):
+    """
+    Return the DerivedOutputs of a result, cached on the result itself.
+
+    Passing params (or sys, for sys.params) updates the cached instance;
+    otherwise result.params is used.
+    """
+    if params is None and sys is not None and not getattr(result, 'params', None):
+        params = sys.params
+    derived = getattr(result, 'derived', None)
+    if derived is None:
+        derived = DerivedOutputs(result, params)
+        result.derived = derived
+    elif params is not None and params is not derived.params:
+        derived.set_params(params)
+    return derived
+
+
+if __name__ == '__main__':
+	import control as ct
+	from rigid_body import make_quadcopter_nonlinear, quadcopter_nonlinear, output_names
+	from utilities import inertial_to_body
+
+	params = {
+	    'mass': 2.0,
+	    'gravity': 9.81,
+	    'arm_length': 0.25,
+	    'density': 1.225,
+	    'cd': 1.5,
+	    'area': 0.02,
+	    'inertia': np.diag([0.0023, 0.0023, 0.004])
+	}
+
+	t = np.arange(0.0, 1.0, 0.01)
+	U = np.vstack([np.full_like(t, w) for w in (2200.0, 2250.0, 2200.0, 2210.0)])
+	x0 = np.zeros(12)
+
+	full = ct.input_output_response(quadcopter_nonlinear, T=t, U=U, X0=x0, params=params)
+
+	# a position-only system integrates the same states
+	subset = ct.input_output_response(make_quadcopter_nonlinear(['pos_x', 'pos_y', 'pos_z']), T=t, U=U, X0=x0, params=params)
+	assert np.allclose(subset.states, full.states)
+	assert np.allclose(subset.outputs, full.outputs[:3])
+
+	# derived channels match the ones integrated by the full system
+	derived = derived_outputs(subset)
+	assert derived is derived_outputs(subset)
+	assert np.allclose(derived['wrench'], full.outputs[16:20])
+	assert np.allclose(derived['load_factor'], full.outputs[16] / (params['mass'] * params['gravity']))
+	for k in range(len(t)):
+		x = full.states[:, k]
+		assert np.allclose(derived['vel_body'][:, k], inertial_to_body(x[6], x[7], x[8]) @ x[3:6])
+
+	# a selection with wrench channels goes through outputs()[index]
+	channels = ['thrust', 'pos_z', 'torque_z', 'r2']
+	mixed = ct.input_output_response(make_quadcopter_nonlinear(channels), T=t, U=U, X0=x0, params=params)
+	assert np.allclose(mixed.outputs, full.outputs[[output_names.index(name) for name in channels]])
+	assert np.array_equal(derived_outputs(mixed)['thrust'], mixed.outputs[0])
+
+	# inside an interconnect the rotor speeds are integrated outputs, not inputs
+	body = make_quadcopter_nonlinear(['pos_z', 'r1', 'r2', 'r3', 'r4'], name='body')
+	mixer = ct.nlsys(None, lambda t, x, u, params: np.full(4, u[0]), inputs=['w'], outputs=['m1', 'm2', 'm3', 'm4'], name='mixer')
+	interconnected = ct.interconnect(
+		(mixer, body),
+		connections=[[f'body.r{i}', f'mixer.m{i}'] for i in range(1, 5)],
+		inplist=['mixer.w'], inputs=['w'],
+		outlist=['body.pos_z', 'body.r1', 'body.r2', 'body.r3', 'body.r4'], outputs=['pos_z', 'r1', 'r2', 'r3', 'r4']
+	)
+	hover = ct.input_output_response(interconnected, T=t, U=np.full((1, len(t)), 2215.0), X0=x0, params=params)
+	assert np.allclose(derived_outputs(hover)['thrust'], 4 * rotor_map[0, 0] * 2215.0**2)
+
+	# params assigned to the system instead of passed to input_output_response
+	quadcopter_nonlinear.params = params
+	result = ct.input_output_response(quadcopter_nonlinear, T=t, U=U, X0=x0)
+	assert np.allclose(derived_outputs(result, sys=quadcopter_nonlinear)['load_factor'], derived['load_factor'])
+
+	print('derived output checks passed')
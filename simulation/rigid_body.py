@@ -63,11 +63,61 @@ def outputs(t, x, u, params):
     # Return outputs
     return np.hstack([x, u, [thrust, torque_x, torque_y, torque_z]])
 
-quadcopter_nonlinear = ct.nlsys(updfcn=dynamics, outfcn=outputs, states=12, inputs=4, outputs=20, name='quadcopter_nonlinear')
-
-quadcopter_nonlinear.set_states(['pos_x', 'pos_y', 'pos_z', 'vel_x', 'vel_y', 'vel_z', 'phi', 'theta', 'psi', 'p', 'q', 'r'])
-quadcopter_nonlinear.set_inputs(['r1', 'r2', 'r3', 'r4'])
-quadcopter_nonlinear.set_outputs(['pos_x', 'pos_y', 'pos_z', 'vel_x', 'vel_y', 'vel_z', 'phi', 'theta', 'psi', 'p', 'q', 'r', 'r1', 'r2', 'r3', 'r4', 'thrust', 'torque_x', 'torque_y', 'torque_z'])
+state_names = ['pos_x', 'pos_y', 'pos_z', 'vel_x', 'vel_y', 'vel_z', 'phi', 'theta', 'psi', 'p', 'q', 'r']
+input_names = ['r1', 'r2', 'r3', 'r4']
+wrench_names = ['thrust', 'torque_x', 'torque_y', 'torque_z']
+output_names = state_names + input_names + wrench_names
+
+def make_outputs(channels):
+    """
+    Build an output function that only evaluates the requested channels.
+
+    Channels that are not computed during integration can be recovered
+    afterwards from the stored states and inputs with derived_outputs.DerivedOutputs.
+
+    Args:
+        channels: list of names taken from output_names
+
+    Returns:
+        outfcn: output function with the nlsys signature (t, x, u, params)
+    """
+    index = np.array([output_names.index(name) for name in channels], dtype=int)
+    n_x = len(state_names)
+    n_xu = n_x + len(input_names)
+
+    if np.all(index < n_x):
+        # states only, e.g. positions: no stacking and no rotor map
+        return lambda t, x, u, params: np.asarray(x)[index]
+    if np.all(index < n_xu):
+        return lambda t, x, u, params: np.concatenate([x, u])[index]
+    return lambda t, x, u, params: outputs(t, x, u, params)[index]
+
+def make_quadcopter_nonlinear(channels=output_names, name='quadcopter_nonlinear'):
+    """
+    Create the rigid body system with only the given output channels.
+
+    Args:
+        channels: list of output names to compute during integration (default: all 20)
+        name: system name
+
+    Returns:
+        sys: nonlinear input/output system
+    """
+    channels = list(channels)
+    if channels == output_names:
+        outfcn = outputs
+    else:
+        outfcn = make_outputs(channels)
+
+    sys = ct.nlsys(updfcn=dynamics, outfcn=outfcn, states=len(state_names), inputs=len(input_names), outputs=len(channels), name=name)
+
+    sys.set_states(state_names)
+    sys.set_inputs(input_names)
+    sys.set_outputs(channels)
+
+    return sys
+
+quadcopter_nonlinear = make_quadcopter_nonlinear()
 
 
 if __name__ == '__main__':